@@ -9,21 +9,41 @@ DEFAULT_CONFIG = {
     "backoff_base": 2  
 }
 
+# Parsed config, reused until config.json changes on disk.
+_cache = {"stamp": None, "data": None}
+
 def get_config():
     """
     Loads configuration from config.json.
     Creates the file with defaults if it doesn't exist.
+    The parsed file is cached until its mtime or size changes.
     """
-    if not os.path.exists(CONFIG_FILE):
+    try:
+        st = os.stat(CONFIG_FILE)
+    except FileNotFoundError:
         print(f"Creating default config file: {CONFIG_FILE}")
         with open(CONFIG_FILE, 'w') as f:
             json.dump(DEFAULT_CONFIG, f, indent=4)
-        return DEFAULT_CONFIG
+        return dict(DEFAULT_CONFIG)
+
+    stamp = (st.st_mtime_ns, st.st_size)
+    if _cache["stamp"] == stamp:
+        return dict(_cache["data"])
     
     try:
         with open(CONFIG_FILE, 'r') as f:
-            return json.load(f)
+            data = json.load(f)
     except json.JSONDecodeError:
         print(f"Error: Invalid JSON in {CONFIG_FILE}. Using defaults.")
-        return DEFAULT_CONFIG
+        return dict(DEFAULT_CONFIG)
 
+    _cache["stamp"] = stamp
+    _cache["data"] = data
+    return dict(data)
+
+def invalidate():
+    """
+    Drops the cached config so the next get_config() re-reads the file.
+    """
+    _cache["stamp"] = None
+    _cache["data"] = None
@@ -2,26 +2,117 @@
 
 import sqlite3
 import os
+import threading
+import queue
+import atexit
+from contextlib import contextmanager
 
 
 DB_FILE = "queue.db"
 
+_wal_enabled = False
+
+def _apply_pragmas(conn):
+    """
+    Tunes a fresh connection for many workers sharing one database file.
+    WAL lets readers run alongside the writer; journal_mode is stored in
+    the file itself, so it only needs to be set once per process.
+    """
+    global _wal_enabled
+    if not _wal_enabled:
+        conn.execute("PRAGMA journal_mode=WAL")
+        _wal_enabled = True
+
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA foreign_keys=ON")
+
 def get_db_connection():
     """
     Creates a new database connection.
     This connection is what we use to send SQL commands.
     """
   
-    conn = sqlite3.connect(DB_FILE)
-    
+    conn = sqlite3.connect(DB_FILE, timeout=30)
+    _apply_pragmas(conn)
   
     conn.row_factory = sqlite3.Row
     return conn
 
+_local = threading.local()
+
+def get_connection():
+    """
+    Returns this thread's long-lived connection, opening it on first use.
+    Workers keep one connection for their whole life instead of
+    reconnecting on every poll.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = get_db_connection()
+        _local.conn = conn
+    return conn
+
+def close_connection():
+    """
+    Closes this thread's cached connection, if there is one.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        _local.conn = None
+        conn.close()
+
+class ConnectionPool:
+    """
+    A small stack of idle connections. The most recently released
+    connection is handed out first, and at most `maxsize` are kept idle.
+    """
+
+    def __init__(self, maxsize=4):
+        self._idle = queue.LifoQueue(maxsize=maxsize)
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return get_db_connection()
+
+    def release(self, conn):
+        try:
+            conn.rollback()
+            self._idle.put_nowait(conn)
+        except (sqlite3.Error, queue.Full):
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+_pool = ConnectionPool()
+atexit.register(_pool.close_all)
+
+@contextmanager
+def borrow_conn():
+    """
+    Lends a connection from the process-wide pool for the duration of a
+    `with` block, then returns it for the next command to reuse.
+    """
+    conn = _pool.acquire()
+    try:
+        yield conn
+    finally:
+        _pool.release(conn)
+
 def initialize_database():
- 
-    
-  
+    """
+    Creates or upgrades the schema. Every step is idempotent, so this is
+    safe to run against an existing database, and workers run it on start.
+    Returns False if the database could not be prepared.
+    """
     create_table_sql = """
     CREATE TABLE IF NOT EXISTS jobs (
         id TEXT PRIMARY KEY,
@@ -35,22 +126,50 @@ def initialize_database():
         
         -- This is the key for exponential backoff!
         -- A worker can only pick up jobs where run_at <= now()
-        run_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-        
-        -- Bonus: We'll add these now to make logging easier later
+        run_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    """
+
+    # Job output lives in its own table so that the small, hot `jobs` rows
+    # the worker scans are not spread across pages full of log text.
+    create_logs_table_sql = """
+    CREATE TABLE IF NOT EXISTS job_logs (
+        id TEXT PRIMARY KEY REFERENCES jobs(id) ON DELETE CASCADE,
         output_log TEXT,
         error_log TEXT
     );
     """
-    
 
-    create_trigger_sql = """
-    CREATE TRIGGER IF NOT EXISTS update_jobs_updated_at
-    AFTER UPDATE ON jobs
-    FOR EACH ROW
-    BEGIN
-        UPDATE jobs SET updated_at = CURRENT_TIMESTAMP WHERE id = OLD.id;
-    END;
+    # Partial index covering only the rows the worker's claim query can
+    # match, so finding the next due job is a B-tree seek, not a scan.
+    create_index_sql = """
+    CREATE INDEX IF NOT EXISTS idx_jobs_pending
+    ON jobs (state, run_at)
+    WHERE state = 'pending';
+    """
+
+    # Covers the per-state counts behind `status` and gives `list --state`
+    # its rows already in created_at order, so a limit stops the scan early.
+    create_state_index_sql = """
+    CREATE INDEX IF NOT EXISTS idx_jobs_state_created
+    ON jobs (state, created_at);
+    """
+
+    # updated_at is set inline by every UPDATE; drop the trigger that
+    # older databases used for it, since it rewrote each row a second time.
+    drop_trigger_sql = "DROP TRIGGER IF EXISTS update_jobs_updated_at"
+
+    # Databases created before job_logs existed kept output on `jobs`
+    # itself. Copy it across (without overwriting newer rows) and clear
+    # the old columns so those pages shrink back down.
+    copy_legacy_logs_sql = """
+    INSERT OR IGNORE INTO job_logs (id, output_log, error_log)
+    SELECT id, output_log, error_log FROM jobs
+    WHERE output_log IS NOT NULL OR error_log IS NOT NULL;
+    """
+    clear_legacy_logs_sql = """
+    UPDATE jobs SET output_log = NULL, error_log = NULL
+    WHERE output_log IS NOT NULL OR error_log IS NOT NULL;
     """
 
     try:
@@ -60,20 +179,37 @@ def initialize_database():
         print("Creating 'jobs' table if it doesn't exist...")
         cursor.execute(create_table_sql)
         
-        print("Creating 'updated_at' trigger...")
-        cursor.execute(create_trigger_sql)
+        print("Creating 'job_logs' table if it doesn't exist...")
+        cursor.execute(create_logs_table_sql)
+        
+        print("Creating 'idx_jobs_pending' index...")
+        cursor.execute(create_index_sql)
+        
+        print("Creating 'idx_jobs_state_created' index...")
+        cursor.execute(create_state_index_sql)
+        
+        cursor.execute(drop_trigger_sql)
+        
+        columns = {row['name'] for row in cursor.execute("PRAGMA table_info(jobs)")}
+        if "output_log" in columns:
+            print("Moving old job output into 'job_logs'...")
+            cursor.execute(copy_legacy_logs_sql)
+            cursor.execute(clear_legacy_logs_sql)
         
         conn.commit()
         conn.close()
         
         print(f"Database '{DB_FILE}' initialized successfully.")
+        return True
         
     except sqlite3.Error as e:
         print(f"An error occurred: {e}")
+        return False
 
 
 if __name__ == "__main__":
-    if not os.path.exists(DB_FILE):
-        initialize_database()
-    else:
-        print(f"Database file '{DB_FILE}' already exists.")
\ No newline at end of file
+    # Every statement above is idempotent, so running this against an
+    # existing database adds any tables or indexes it is missing.
+    if os.path.exists(DB_FILE):
+        print(f"Database file '{DB_FILE}' already exists. Upgrading schema...")
+    initialize_database()
@@ -4,13 +4,9 @@ import json
 import sqlite3
 import os
 import sys
-import signal
-import subprocess
-import platform  
-from db import get_db_connection
-from config import get_config, CONFIG_FILE
-from typing_extensions import Annotated
-from typing import Optional
+from db import borrow_conn
+from config import get_config, invalidate as invalidate_config, CONFIG_FILE
+from typing import Annotated, Optional
 
 PID_FILE = "workers.pid"
 
@@ -25,6 +21,53 @@ app.add_typer(worker_app, name="worker")
 
 
 
+def _is_worker_process(pid):
+    """
+    True if `pid` is a live `worker.py` process. workers.pid can be stale
+    after a crash or reboot, and the PID may now belong to anything.
+    """
+    if os.path.isdir("/proc"):
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                argv = f.read().split(b"\0")
+        except OSError:
+            return False
+        return any(os.path.basename(arg) == b"worker.py" for arg in argv)
+
+    import subprocess
+    try:
+        out = subprocess.run(
+            ["ps", "-p", str(pid), "-o", "command="],
+            capture_output=True, text=True, check=False
+        ).stdout
+    except OSError:
+        return False
+    return any(os.path.basename(arg) == "worker.py" for arg in out.split())
+
+def wake_workers():
+    """
+    Nudges idle workers so a new job is picked up without waiting for
+    their next scheduled poll. Best effort: errors are ignored.
+    SIGUSR1 terminates a process that has no handler for it, so it is
+    only sent to PIDs that are verified to be running worker.py.
+    """
+    import signal
+
+    if not hasattr(signal, "SIGUSR1") or not os.path.exists(PID_FILE):
+        return
+    try:
+        with open(PID_FILE, "r") as f:
+            pids = [int(pid) for pid in f.read().splitlines()]
+    except (OSError, ValueError):
+        return
+    for pid in pids:
+        if not _is_worker_process(pid):
+            continue
+        try:
+            os.kill(pid, signal.SIGUSR1)
+        except OSError:
+            pass
+
 @app.command()
 def enqueue(
     job_json_str: Annotated[str, typer.Argument(
@@ -38,78 +81,156 @@ def enqueue(
         if not job_id or not command:
             typer.echo("Error: JSON must include 'id' and 'command' keys.")
             raise typer.Exit(code=1)
-        conn = get_db_connection()
-        sql = "INSERT INTO jobs (id, command) VALUES (?, ?)"
-        try:
-            conn.cursor().execute(sql, (job_id, command))
-            conn.commit()
-            typer.echo(f"✅ Job '{job_id}' enqueued successfully.")
-        except sqlite3.IntegrityError:
+        # A duplicate id is detected from rowcount rather than by raising
+        # and catching IntegrityError.
+        sql = "INSERT OR IGNORE INTO jobs (id, command) VALUES (?, ?)"
+        with borrow_conn() as conn:
+            try:
+                cursor = conn.execute(sql, (job_id, command))
+                conn.commit()
+            except sqlite3.Error as e:
+                typer.echo(f"Database error: {e}")
+                raise typer.Exit(code=1)
+        if cursor.rowcount == 0:
             typer.echo(f"Error: Job with ID '{job_id}' already exists.")
             raise typer.Exit(code=1)
-        except sqlite3.Error as e:
-            typer.echo(f"Database error: {e}")
-            raise typer.Exit(code=1)
-        finally:
-            conn.close()
+        typer.echo(f"✅ Job '{job_id}' enqueued successfully.")
+        wake_workers()
     except json.JSONDecodeError:
         typer.echo("Error: Invalid JSON string provided.")
         raise typer.Exit(code=1)
 
+@app.command("enqueue-batch")
+def enqueue_batch(
+    source: Annotated[str, typer.Argument(
+        help="Path to a JSON file holding a list of jobs, or '-' to read it from stdin."
+    )] = "-"
+):
+    try:
+        if source == "-":
+            jobs = json.load(sys.stdin)
+        else:
+            with open(source, "r") as f:
+                jobs = json.load(f)
+    except OSError as e:
+        typer.echo(f"Error reading '{source}': {e}")
+        raise typer.Exit(code=1)
+    except json.JSONDecodeError:
+        typer.echo("Error: Invalid JSON provided.")
+        raise typer.Exit(code=1)
+
+    # `list` is shadowed by the list command in this module.
+    if not isinstance(jobs, type([])):
+        typer.echo("Error: JSON must be a list of job objects.")
+        raise typer.Exit(code=1)
+    rows = []
+    for job_data in jobs:
+        job_id = job_data.get('id') if isinstance(job_data, dict) else None
+        command = job_data.get('command') if isinstance(job_data, dict) else None
+        if not job_id or not command:
+            typer.echo("Error: Every job must include 'id' and 'command' keys.")
+            raise typer.Exit(code=1)
+        rows.append((job_id, command))
+
+    # One transaction for the whole batch, so it costs a single commit.
+    # Duplicate ids are skipped rather than aborting the batch.
+    sql = "INSERT OR IGNORE INTO jobs (id, command) VALUES (?, ?)"
+    with borrow_conn() as conn:
+        try:
+            with conn:
+                inserted = conn.executemany(sql, rows).rowcount
+        except sqlite3.Error as e:
+            typer.echo(f"Database error: {e}")
+            raise typer.Exit(code=1)
+
+    typer.echo(f"✅ Enqueued {inserted} of {len(rows)} job(s).")
+    if inserted < len(rows):
+        typer.echo(f"Skipped {len(rows) - inserted} job(s) whose ID already exists.")
+    if inserted:
+        wake_workers()
+
+def _snapshot(conn):
+    """
+    Per-state job counts for `status`, from one aggregate pass over the
+    covering idx_jobs_state_created index rather than the table itself.
+    """
+    sql = "SELECT state, COUNT(*) AS count FROM jobs GROUP BY state"
+    return {row['state']: row['count'] for row in conn.execute(sql)}
+
 @app.command()
 def status():
-    conn = get_db_connection()
-    try:
-        sql = "SELECT state, COUNT(*) as count FROM jobs GROUP BY state"
-        cursor = conn.cursor()
-        cursor.execute(sql)
-        results = cursor.fetchall()
-        typer.echo("--- Job Status Summary ---")
-        if not results:
-            typer.echo("No jobs found.")
-            return
-        state_map = {row['state']: row['count'] for row in results}
-        states = ['pending', 'processing', 'completed', 'failed', 'dead']
-        for state in states:
-            count = state_map.get(state, 0)
-            typer.echo(f"- {state.capitalize():<12}: {count}")
-    except sqlite3.Error as e:
-        typer.echo(f"Database error: {e}")
-    finally:
-        conn.close()
+    with borrow_conn() as conn:
+        try:
+            state_map = _snapshot(conn)
+            typer.echo("--- Job Status Summary ---")
+            if not state_map:
+                typer.echo("No jobs found.")
+                return
+            states = ['pending', 'processing', 'completed', 'failed', 'dead']
+            for state in states:
+                count = state_map.get(state, 0)
+                typer.echo(f"- {state.capitalize():<12}: {count}")
+        except sqlite3.Error as e:
+            typer.echo(f"Database error: {e}")
 
 @app.command()
 def list(
     state: Annotated[Optional[str], typer.Option(
         help="Filter jobs by state (e.g., 'pending', 'dead')"
-    )] = None
+    )] = None,
+    limit: Annotated[Optional[int], typer.Option(
+        min=1, help="Show at most this many of the newest jobs."
+    )] = None,
+    logs: Annotated[bool, typer.Option(
+        "--logs", help="Also show each job's stored stdout and stderr."
+    )] = False
 ):
-    conn = get_db_connection()
-    try:
-        sql = "SELECT id, state, command, attempts, run_at FROM jobs"
-        params = []
-        if state:
-            sql += " WHERE state = ?"
-            params.append(state)
-        sql += " ORDER BY created_at DESC"
-        cursor = conn.cursor()
-        cursor.execute(sql, params)
-        jobs = cursor.fetchall()
-        if not jobs:
-            typer.echo(f"No jobs found" + (f" with state '{state}'." if state else "."))
-            return
-        typer.echo(f"--- Showing {len(jobs)} Jobs ---")
-        for job in jobs:
-            typer.echo(f"Job ID: {job['id']}")
-            typer.echo(f"  State:    {job['state']}")
-            typer.echo(f"  Command:  {job['command']}")
-            typer.echo(f"  Attempts: {job['attempts']}")
-            typer.echo(f"  Run At:   {job['run_at']}")
-            typer.echo("-" * 20)
-    except sqlite3.Error as e:
-        typer.echo(f"Database error: {e}")
-    finally:
-        conn.close()
+    with borrow_conn() as conn:
+        try:
+            # One read transaction, so the header count and the rows
+            # come from the same snapshot of the table.
+            conn.execute("BEGIN")
+            where = " WHERE state = ?" if state else ""
+            params = [state] if state else []
+            if limit:
+                # Skip the count so the index walk can stop after `limit` rows.
+                header = f"--- Showing up to {limit} Jobs ---"
+            else:
+                total = conn.execute("SELECT COUNT(*) FROM jobs" + where, params).fetchone()[0]
+                header = f"--- Showing {total} Jobs ---"
+
+            # Logs live in job_logs; only join it when they were asked for.
+            sql = "SELECT j.id, j.state, j.command, j.attempts, j.run_at"
+            if logs:
+                sql += ", l.output_log, l.error_log FROM jobs j LEFT JOIN job_logs l ON l.id = j.id"
+            else:
+                sql += " FROM jobs j"
+            if state:
+                sql += " WHERE j.state = ?"
+            sql += " ORDER BY j.created_at DESC"
+            if limit:
+                sql += " LIMIT ?"
+                params.append(limit)
+            # Stream rows straight from the cursor instead of fetchall(),
+            # so a large queue is printed without holding it all in memory.
+            shown = 0
+            for job in conn.execute(sql, params):
+                if shown == 0:
+                    typer.echo(header)
+                shown += 1
+                typer.echo(f"Job ID: {job['id']}")
+                typer.echo(f"  State:    {job['state']}")
+                typer.echo(f"  Command:  {job['command']}")
+                typer.echo(f"  Attempts: {job['attempts']}")
+                typer.echo(f"  Run At:   {job['run_at']}")
+                if logs:
+                    typer.echo(f"  Output:   {(job['output_log'] or '').rstrip()}")
+                    typer.echo(f"  Errors:   {(job['error_log'] or '').rstrip()}")
+                typer.echo("-" * 20)
+            if shown == 0:
+                typer.echo(f"No jobs found" + (f" with state '{state}'." if state else "."))
+        except sqlite3.Error as e:
+            typer.echo(f"Database error: {e}")
 
 @dlq_app.command("list")
 def dlq_list():
@@ -120,20 +241,18 @@ def dlq_list():
 def dlq_retry(
     job_id: Annotated[str, typer.Argument(help="The ID of the job to retry.")]
 ):
-    conn = get_db_connection()
-    try:
-        sql = "UPDATE jobs SET state = 'pending', attempts = 0, run_at = CURRENT_TIMESTAMP WHERE id = ? AND state = 'dead'"
-        cursor = conn.cursor()
-        cursor.execute(sql, (job_id,))
-        if cursor.rowcount == 0:
-            typer.echo(f"Error: Job '{job_id}' not found in DLQ ('dead').")
-        else:
-            conn.commit()
-            typer.echo(f" Job '{job_id}' moved to 'pending' for retry.")
-    except sqlite3.Error as e:
-        typer.echo(f"Database error: {e}")
-    finally:
-        conn.close()
+    with borrow_conn() as conn:
+        try:
+            sql = "UPDATE jobs SET state = 'pending', attempts = 0, run_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP WHERE id = ? AND state = 'dead'"
+            cursor = conn.cursor()
+            cursor.execute(sql, (job_id,))
+            if cursor.rowcount == 0:
+                typer.echo(f"Error: Job '{job_id}' not found in DLQ ('dead').")
+            else:
+                conn.commit()
+                typer.echo(f" Job '{job_id}' moved to 'pending' for retry.")
+        except sqlite3.Error as e:
+            typer.echo(f"Database error: {e}")
 
 @config_app.command("set")
 def config_set(
@@ -146,6 +265,7 @@ def config_set(
     config[key] = value
     try:
         with open(CONFIG_FILE, 'w') as f: json.dump(config, f, indent=4)
+        invalidate_config()
         typer.echo(f"Config updated: {key} = {value}")
     except Exception as e:
         typer.echo(f"Error writing config file: {e}")
@@ -160,12 +280,17 @@ def config_show():
 def worker_start(
     count: Annotated[int, typer.Option(
         help="Number of worker processes to start."
+    )] = 1,
+    concurrency: Annotated[int, typer.Option(
+        min=1, help="Number of jobs each worker runs at the same time."
     )] = 1
 ):
-    
-    
-    
-    
+    # Only the worker commands need these; importing them here keeps
+    # them off the startup path of every other command.
+    import signal
+    import subprocess
+    import platform
+
     pids = []
     typer.echo(f"Starting {count} worker(s)...")
     
@@ -173,16 +298,26 @@ def worker_start(
     if platform.system() == "Windows":
         creation_flags = subprocess.CREATE_NEW_PROCESS_GROUP
 
-    for _ in range(count):
-        process = subprocess.Popen(
-            [sys.executable, "worker.py"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            creationflags=creation_flags
-        )
-        typer.echo(f"Started worker with PID: {process.pid}")
-        pids.append(str(process.pid))
+    # Ignored signals stay ignored across exec, so a wakeup sent before a
+    # new worker has installed its SIGUSR1 handler is dropped instead of
+    # killing it.
+    previous_usr1 = None
+    if hasattr(signal, "SIGUSR1"):
+        previous_usr1 = signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    try:
+        for _ in range(count):
+            process = subprocess.Popen(
+                [sys.executable, "worker.py", "--concurrency", str(concurrency)],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                creationflags=creation_flags
+            )
+            typer.echo(f"Started worker with PID: {process.pid}")
+            pids.append(str(process.pid))
+    finally:
+        if previous_usr1 is not None:
+            signal.signal(signal.SIGUSR1, previous_usr1)
     
     try:
         with open(PID_FILE, "w") as f:
@@ -193,10 +328,10 @@ def worker_start(
 
 @worker_app.command("stop")
 def worker_stop():
-    
-    
-    
-    
+    import signal
+    import subprocess
+    import platform
+
     if not os.path.exists(PID_FILE):
         typer.echo("No workers running (PID file not found).")
         return
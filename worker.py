@@ -1,17 +1,61 @@
 
 import sqlite3
-import time
 import subprocess
 import json
+import os
+import threading
 import signal  
 import sys  
 import platform   
-from datetime import datetime, timedelta, timezone
-from db import get_db_connection
+import argparse
+import functools
+import shlex
+import shutil
+import selectors
+import socket
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Final
+from db import get_connection, close_connection, initialize_database
 from config import get_config
 
 
 SHUTDOWN_REQUESTED = False
+WAKEUP_REQUESTED = False
+
+# Job processes currently running, so a forced exit can kill them.
+_running_procs = set()
+_procs_lock = threading.Lock()
+
+# All worker SQL, parsed once per statement text and shared by every call.
+_SQL_CLAIM: Final = """
+UPDATE jobs SET state = 'processing', updated_at = CURRENT_TIMESTAMP
+WHERE id = (
+    SELECT id FROM jobs
+    WHERE state = 'pending' AND run_at <= CURRENT_TIMESTAMP
+    ORDER BY run_at
+    LIMIT 1
+)
+RETURNING id, command, attempts
+"""
+_SQL_FIND: Final = "SELECT id, command, attempts FROM jobs WHERE state = 'pending' AND run_at <= CURRENT_TIMESTAMP ORDER BY run_at LIMIT 1"
+_SQL_LOCK: Final = "UPDATE jobs SET state = 'processing', updated_at = CURRENT_TIMESTAMP WHERE id = ? AND state = 'pending'"
+_SQL_NEXT_DUE: Final = "SELECT (julianday(MIN(run_at)) - julianday('now')) * 86400 FROM jobs WHERE state = 'pending'"
+_SQL_COMPLETE: Final = "UPDATE jobs SET state = 'completed', updated_at = CURRENT_TIMESTAMP WHERE id = ?"
+_SQL_FAIL_RETRY: Final = "UPDATE jobs SET state = 'pending', attempts = ?, run_at = datetime('now', ?), updated_at = CURRENT_TIMESTAMP WHERE id = ?"
+_SQL_FAIL_DEAD: Final = "UPDATE jobs SET state = 'dead', attempts = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?"
+_SQL_SAVE_LOGS: Final = "INSERT OR REPLACE INTO job_logs (id, output_log, error_log) VALUES (?, ?, ?)"
+
+# Longest stdout/stderr stored per job, in characters (not bytes); longer
+# output keeps its head and tail.
+MAX_LOG_CHARS: Final = 64 * 1024
+_LOG_TRUNCATED: Final = "\n...[truncated]...\n"
+
+# A command containing any of these needs /bin/sh to interpret it.
+_SHELL_CHARS: Final = frozenset("|&;<>()$`\\*?[]{}~#!\n")
+
+# Without a wakeup signal (Windows) a new job is only noticed on the next
+# poll, so keep the old one-second cadence there.
+MAX_IDLE_SLEEP = 30 if hasattr(signal, "SIGUSR1") else 1
 
 def signal_handler(sig, frame):
     
@@ -22,154 +66,312 @@ def signal_handler(sig, frame):
         SHUTDOWN_REQUESTED = True
     else:
         print("Shutdown already requested. Forcing exit.")
+        kill_running_jobs()
         sys.exit(1)
 
+def kill_running_jobs():
+    """
+    Kills every in-flight job. Jobs run in their own session, so the
+    whole process group is killed, including anything a shell spawned.
+    """
+    with _procs_lock:
+        procs = list(_running_procs)
+    for proc in procs:
+        try:
+            if hasattr(os, "killpg"):
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                proc.kill()
+        except OSError:
+            pass
+
+def wakeup_handler(sig, frame):
+    
+    global WAKEUP_REQUESTED
+    WAKEUP_REQUESTED = True
+
 
 signal.signal(signal.SIGTERM, signal_handler)
 signal.signal(signal.SIGINT, signal_handler)
 
 if platform.system() == "Windows":
     signal.signal(signal.SIGBREAK, signal_handler)
+else:
+    signal.signal(signal.SIGUSR1, wakeup_handler)
+
+# Any signal also writes a byte to this socket, so idle_sleep can block in a
+# single select() that ends on timeout or as soon as a signal arrives. A
+# socketpair is used because Windows only supports sockets for both.
+_wakeup_r, _wakeup_w = socket.socketpair()
+_wakeup_r.setblocking(False)
+_wakeup_w.setblocking(False)
+signal.set_wakeup_fd(_wakeup_w.fileno(), warn_on_full_buffer=False)
+_selector = selectors.DefaultSelector()
+_selector.register(_wakeup_r, selectors.EVENT_READ)
 
 
 
-def fetch_and_lock_job(conn):
+def fetch_and_lock_job(cursor):
     """
     Atomically fetches a 'pending' job and locks it by setting 'processing'.
-    (This function is unchanged)
+    On SQLite 3.35+ this is a single UPDATE ... RETURNING statement.
     """
-    cursor = conn.cursor()
+    if sqlite3.sqlite_version_info < (3, 35, 0):
+        return _fetch_and_lock_job_legacy(cursor)
+
     try:
-        find_sql = "SELECT id FROM jobs WHERE state = 'pending' AND run_at <= CURRENT_TIMESTAMP LIMIT 1"
-        cursor.execute(find_sql)
+        cursor.execute(_SQL_CLAIM)
+        job = cursor.fetchone()
+        cursor.connection.commit()
+        return job
+
+    except sqlite3.Error as e:
+        print(f"Database error during fetch/lock: {e}")
+        return None
+
+def _fetch_and_lock_job_legacy(cursor):
+    """
+    Fallback for SQLite builds without RETURNING: find the job, then lock
+    it. The row from the find is returned as-is once the lock succeeds.
+    """
+    try:
+        cursor.execute(_SQL_FIND)
         job_row = cursor.fetchone()
         
         if job_row is None:
             return None
             
         job_id = job_row['id']
-        lock_sql = "UPDATE jobs SET state = 'processing' WHERE id = ? AND state = 'pending'"
-        cursor.execute(lock_sql, (job_id,))
-        conn.commit()
+        cursor.execute(_SQL_LOCK, (job_id,))
+        cursor.connection.commit()
         
         if cursor.rowcount == 0:
             return None
 
-        get_sql = "SELECT * FROM jobs WHERE id = ?"
-        cursor.execute(get_sql, (job_id,))
-        return cursor.fetchone()
+        return job_row
 
     except sqlite3.Error as e:
         print(f"Database error during fetch/lock: {e}")
         return None
 
+def seconds_until_next_job(cursor):
+    """
+    Returns how long to sleep before the earliest pending job becomes due,
+    capped at MAX_IDLE_SLEEP. An empty queue sleeps for the full cap.
+    """
+    delay = cursor.execute(_SQL_NEXT_DUE).fetchone()[0]
+    if delay is None:
+        return MAX_IDLE_SLEEP
+    return max(0, min(MAX_IDLE_SLEEP, delay))
+
+def idle_sleep(delay):
+    """
+    Sleeps for up to `delay` seconds, returning early on shutdown or when
+    the CLI signals that a new job was enqueued.
+    """
+    global WAKEUP_REQUESTED
+    if not SHUTDOWN_REQUESTED and not WAKEUP_REQUESTED:
+        _selector.select(timeout=delay)
+    try:
+        while _wakeup_r.recv(4096):
+            pass
+    except BlockingIOError:
+        pass
+    WAKEUP_REQUESTED = False
+
+def build_args(command):
+    """
+    Returns (args, shell) for subprocess. A plain "program arg ..." command
+    whose program is found on PATH is exec'd directly, skipping the extra
+    /bin/sh process. Anything else (metacharacters, builtins such as exit
+    or command, VAR=value prefixes) still goes through the shell.
+    Windows always uses the shell, since echo, timeout etc. are cmd builtins.
+    """
+    if platform.system() == "Windows" or not _SHELL_CHARS.isdisjoint(command):
+        return command, True
+    try:
+        args = shlex.split(command)
+    except ValueError:
+        return command, True
+    if not args or shutil.which(args[0]) is None:
+        return command, True
+    return args, False
+
+def clip_log(text, limit=MAX_LOG_CHARS):
+    """
+    Caps a captured log at `limit` characters, keeping the first and last
+    halves, so one noisy job cannot bloat the database.
+    """
+    if not text or len(text) <= limit:
+        return text
+    half = (limit - len(_LOG_TRUNCATED)) // 2
+    return text[:half] + _LOG_TRUNCATED + text[-half:]
+
 def run_job(job):
     
     command = job['command']
     job_id = job['id']
     print(f"--- Starting job: {job_id} | Command: {command} ---")
+    args, shell = build_args(command)
     try:
-        result = subprocess.run(
-            command, shell=True, capture_output=True, text=True, check=False
+        # A new session keeps a Ctrl+C aimed at the worker from also
+        # killing the job it is finishing during a graceful shutdown.
+        proc = subprocess.Popen(
+            args, shell=shell, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            text=True, start_new_session=True
         )
+        with _procs_lock:
+            _running_procs.add(proc)
+        try:
+            stdout, stderr = proc.communicate()
+        finally:
+            with _procs_lock:
+                _running_procs.discard(proc)
+        result = subprocess.CompletedProcess(args, proc.returncode, stdout, stderr)
         print(f"--- Finished job: {job_id} | Exit Code: {result.returncode} ---")
+        result.stdout = clip_log(result.stdout)
+        result.stderr = clip_log(result.stderr)
         return result
+    except (FileNotFoundError, PermissionError) as e:
+        # Match the shell's "not found" (127) and "not executable" (126).
+        print(f"Error running job {job_id}: {e}")
+        return subprocess.CompletedProcess(
+            args=command, returncode=127 if isinstance(e, FileNotFoundError) else 126,
+            stdout="", stderr=str(e)
+        )
     except Exception as e:
         print(f"Error running job {job_id}: {e}")
         return subprocess.CompletedProcess(
             args=command, returncode=1, stdout="", stderr=str(e)
         )
 
-def handle_job_result(conn, job, result, config):
-    
+def handle_job_result(cursor, job, result, config):
+    """
+    Records a finished job: its new state in `jobs` and its output in
+    `job_logs`. Both writes share a single transaction and one commit.
+    """
     job_id = job['id']
-    if result.returncode == 0:
-        print(f" Job {job_id} completed successfully.")
-        sql = "UPDATE jobs SET state = 'completed', output_log = ?, error_log = ? WHERE id = ?"
-        try:
-            conn.cursor().execute(sql, (result.stdout, result.stderr, job_id))
-            conn.commit()
-        except sqlite3.Error as e:
-            print(f"Database error completing job {job_id}: {e}")
-    else:
-        print(f" Job {job_id} failed. Attempt {job['attempts'] + 1}")
-        fail_job(conn, job, result, config)
+    try:
+        with cursor.connection:
+            if result.returncode == 0:
+                print(f" Job {job_id} completed successfully.")
+                cursor.execute(_SQL_COMPLETE, (job_id,))
+            else:
+                print(f" Job {job_id} failed. Attempt {job['attempts'] + 1}")
+                fail_job(cursor, job, config)
+            cursor.execute(_SQL_SAVE_LOGS, (job_id, result.stdout, result.stderr))
+    except sqlite3.Error as e:
+        print(f"Database error recording result for job {job_id}: {e}")
 
-def fail_job(conn, job, result, config):
-    
+@functools.lru_cache(maxsize=None)
+def backoff_delay(backoff_base, attempts):
+    """
+    Retry delay after `attempts` failures, as (seconds, SQLite modifier).
+    The modifier ("+N seconds") lets SQLite compute run_at itself, in the
+    same format as CURRENT_TIMESTAMP. Cached, since a worker only ever
+    sees max_retries distinct values.
+    """
+    delay_seconds = backoff_base ** attempts
+    return delay_seconds, f"+{delay_seconds} seconds"
+
+def fail_job(cursor, job, config):
+    """
+    Schedules a retry or moves the job to the DLQ. Runs inside the
+    caller's transaction; it does not commit.
+    """
     job_id = job['id']
-    max_retries = config.get('max_retries', 3)
-    backoff_base = config.get('backoff_base', 2)
     current_attempts = job['attempts'] + 1
+    dead = current_attempts >= config.get('max_retries', 3)
     
-    if current_attempts >= max_retries:
+    if dead:
         print(f" Job {job_id} hit max retries. Moving to DLQ ('dead').")
-        sql = "UPDATE jobs SET state = 'dead', attempts = ?, output_log = ?, error_log = ? WHERE id = ?"
-        params = (current_attempts, result.stdout, result.stderr, job_id)
+        sql, params = _SQL_FAIL_DEAD, (current_attempts, job_id)
     else:
-        delay_seconds = backoff_base ** current_attempts
-        next_run_time = datetime.now(timezone.utc) + timedelta(seconds=delay_seconds)
-        print(f"Job {job_id} will retry in {delay_seconds} seconds (at {next_run_time}).")
-        sql = "UPDATE jobs SET state = 'pending', attempts = ?, run_at = ?, output_log = ?, error_log = ? WHERE id = ?"
-        params = (current_attempts, next_run_time, result.stdout, result.stderr, job_id)
+        delay_seconds, run_at_modifier = backoff_delay(config.get('backoff_base', 2), current_attempts)
+        print(f"Job {job_id} will retry in {delay_seconds} seconds.")
+        sql, params = _SQL_FAIL_RETRY, (current_attempts, run_at_modifier, job_id)
     
-    try:
-        conn.cursor().execute(sql, params)
-        conn.commit()
-    except sqlite3.Error as e:
-        print(f"Database error failing job {job_id}: {e}")
+    cursor.execute(sql, params)
 
 
 
-def worker_loop():
+def collect_result(future, job):
     
-    print(" Smart Worker started. Waiting for jobs... ")
+    try:
+        return future.result()
+    except Exception as e:
+        print(f"An unexpected error occurred running job {job['id']}: {e}")
+        return subprocess.CompletedProcess(
+            args=job['command'], returncode=1, stdout="", stderr=str(e)
+        )
+
+def worker_loop(concurrency=1):
+    """
+    Runs up to `concurrency` jobs at a time. Job commands run on a thread
+    pool; all database access stays on this thread and its connection.
+    """
+    print(f" Smart Worker started (concurrency {concurrency}). Waiting for jobs... ")
     config = get_config()
     print(f"Config loaded: {config}")
     
+    # A database created by an older version may lack job_logs; recording
+    # a result would then fail and leave the job stuck in 'processing'.
+    if not initialize_database():
+        print("Could not prepare the database schema. Exiting.")
+        sys.exit(1)
     
-    while not SHUTDOWN_REQUESTED:
-        conn = get_db_connection()
-        job = None
-        try:
-            
-            
-            job = fetch_and_lock_job(conn)
-            
-            if job:
-                result = run_job(job)
-                
-                
-                if SHUTDOWN_REQUESTED:
-                    print(f"Shutdown requested, but job {job['id']} finished. Handling result...")
-                
-                handle_job_result(conn, job, result, config)
-                
-            else:
-                
-                for _ in range(10): 
-                    if SHUTDOWN_REQUESTED:
+    running = {}
+    cursor = get_connection().cursor()
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        while not SHUTDOWN_REQUESTED or running:
+            try:
+                while not SHUTDOWN_REQUESTED and len(running) < concurrency:
+                    job = fetch_and_lock_job(cursor)
+                    if not job:
                         break
-                    time.sleep(0.1)
-                
-        except sqlite3.Error as e:
-            print(f"Database error in main loop: {e}")
-            if not SHUTDOWN_REQUESTED: time.sleep(5)
-        except Exception as e:
-            print(f"An unexpected error occurred: {e}")
-            if job:
-                print(f"Trying to fail job {job['id']} due to unexpected error.")
-                fake_result = subprocess.CompletedProcess(
-                    args=job['command'], returncode=1, stdout="", stderr=str(e)
-                )
-                handle_job_result(conn, job, fake_result, config)
-            if not SHUTDOWN_REQUESTED: time.sleep(5)
-        finally:
-            conn.close()
+                    running[executor.submit(run_job, job)] = job
+
+                if not running:
+                    idle_sleep(seconds_until_next_job(cursor))
+                    continue
+
+                # With free slots, wake up now and then to claim jobs
+                # that became due while the others are still running.
+                timeout = None
+                if len(running) < concurrency and not SHUTDOWN_REQUESTED:
+                    timeout = min(1, seconds_until_next_job(cursor))
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    job = running.pop(future)
+                    result = collect_result(future, job)
+                    if SHUTDOWN_REQUESTED:
+                        print(f"Shutdown requested, but job {job['id']} finished. Handling result...")
+                    handle_job_result(cursor, job, result, config)
             
+            except sqlite3.Error as e:
+                print(f"Database error in main loop: {e}")
+                idle_sleep(5)
+            except Exception as e:
+                print(f"An unexpected error occurred: {e}")
+                idle_sleep(5)
+    finally:
+        # A graceful exit only leaves the loop once nothing is running.
+        # On a forced exit the jobs were already killed, so don't wait.
+        executor.shutdown(wait=False, cancel_futures=True)
+        close_connection()
     
     print("Worker shutting down gracefully. Goodbye.")
 
 
 if __name__ == "__main__":
-    worker_loop()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run a queuectl worker.")
+    parser.add_argument(
+        "--concurrency", type=int, default=1,
+        help="Number of jobs this worker runs at the same time."
+    )
+    args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    worker_loop(args.concurrency)